@@ -3,10 +3,10 @@ import sqlite3
 import os
 import dotenv
 import base64
-from PIL import Image
+import re
+import time
+import unicodedata
 from io import BytesIO
-import google.generativeai as genai
-import streamlit.components.v1 as components
 
 dotenv.load_dotenv()
 
@@ -18,6 +18,7 @@ def get_image_base64(image_raw):
     return base64.b64encode(img_byte).decode('utf-8')
 
 def base64_to_image(base64_string):
+    from PIL import Image
     base64_string = base64_string.split(",")[1]
     return Image.open(BytesIO(base64.b64decode(base64_string)))
 
@@ -75,11 +76,58 @@ def update_schema(conn):
     if "chat_id" not in columns:
         cursor.execute("ALTER TABLE conversations ADD COLUMN chat_id INTEGER")
         conn.commit()
+    # Índice de busca textual (FTS5) sobre o conteúdo das conversas.
+    # A tabela usa conteúdo externo e é mantida em sincronia por triggers,
+    # cobrindo add_message e o DELETE do "Resetar conversa". O user_id também é
+    # indexado para que o próprio MATCH filtre as mensagens do usuário.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'")
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            CREATE VIRTUAL TABLE conversations_fts USING fts5(
+                content,
+                user_id,
+                content='conversations',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN
+                INSERT INTO conversations_fts(rowid, content, user_id) VALUES (new.id, new.content, new.user_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN
+                INSERT INTO conversations_fts(conversations_fts, rowid, content, user_id) VALUES ('delete', old.id, old.content, old.user_id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE OF content, user_id ON conversations BEGIN
+                INSERT INTO conversations_fts(conversations_fts, rowid, content, user_id) VALUES ('delete', old.id, old.content, old.user_id);
+                INSERT INTO conversations_fts(rowid, content, user_id) VALUES (new.id, new.content, new.user_id);
+            END
+        """)
+        # Indexa as mensagens já existentes
+        cursor.execute("INSERT INTO conversations_fts(conversations_fts) VALUES ('rebuild')")
+        conn.commit()
+    # Resumo persistido das mensagens antigas de cada chat (janela de contexto)
+    cursor.execute("PRAGMA table_info(chat_sessions)")
+    session_columns = [col[1] for col in cursor.fetchall()]
+    if "summary" not in session_columns:
+        cursor.execute("ALTER TABLE chat_sessions ADD COLUMN summary TEXT")
+    if "summary_upto" not in session_columns:
+        cursor.execute("ALTER TABLE chat_sessions ADD COLUMN summary_upto INTEGER DEFAULT 0")
+    conn.commit()
 
-conn = init_db()
+@st.cache_resource
+def get_connection():
+    # Inicializa o banco uma única vez por processo, no primeiro acesso,
+    # em vez de como efeito colateral do import do módulo
+    return init_db()
 
 # Função para cadastrar usuário (incluindo dados de saúde)
 def register_user(username, password, api_key, idade, peso, altura, nivel_atividade, restricoes_alimentares):
+    conn = get_connection()
     cursor = conn.cursor()
     restricoes_str = ",".join(restricoes_alimentares) if restricoes_alimentares else ""
     try:
@@ -94,6 +142,7 @@ def register_user(username, password, api_key, idade, peso, altura, nivel_ativid
 
 # Atualiza os dados de saúde do usuário
 def update_user_health(user_id, idade, peso, altura, nivel_atividade, restricoes_alimentares):
+    conn = get_connection()
     cursor = conn.cursor()
     restricoes_str = ",".join(restricoes_alimentares) if restricoes_alimentares else ""
     cursor.execute(
@@ -104,6 +153,7 @@ def update_user_health(user_id, idade, peso, altura, nivel_atividade, restricoes
 
 # Busca usuário (incluindo dados de saúde) para login
 def login_user(username, password):
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT id, api_key, idade, peso, altura, nivel_atividade, restricoes_alimentares FROM users WHERE username = ? AND password = ?",
@@ -125,17 +175,20 @@ def login_user(username, password):
         return None
 
 def create_chat_session(user_id, title="Novo Chat"):
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO chat_sessions (user_id, title) VALUES (?, ?)", (user_id, title))
     conn.commit()
     return cursor.lastrowid
 
 def get_chat_sessions(user_id):
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, title, timestamp FROM chat_sessions WHERE user_id = ? ORDER BY timestamp DESC", (user_id,))
     return cursor.fetchall()
 
 def get_conversation_history(chat_id):
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT role, content, timestamp FROM conversations WHERE chat_id = ? ORDER BY timestamp", (chat_id,))
     rows = cursor.fetchall()
@@ -145,6 +198,7 @@ def get_conversation_history(chat_id):
     return history
 
 def add_message(chat_id, user_id, role, content):
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT INTO conversations (chat_id, user_id, role, content) VALUES (?, ?, ?, ?)",
@@ -152,6 +206,141 @@ def add_message(chat_id, user_id, role, content):
     )
     conn.commit()
 
+def get_chat_summary(chat_id):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT summary, summary_upto FROM chat_sessions WHERE id = ?", (chat_id,))
+    result = cursor.fetchone()
+    if result and result[0]:
+        return result[0], result[1] or 0
+    return "", 0
+
+def save_chat_summary(chat_id, summary, summary_upto):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE chat_sessions SET summary = ?, summary_upto = ? WHERE id = ?",
+        (summary, summary_upto, chat_id)
+    )
+    conn.commit()
+
+# As mensagens que casam com a busca são percorridas da mais recente para a mais
+# antiga em janelas de SEARCH_WINDOW mensagens, ranqueadas dentro de cada janela
+SEARCH_WINDOW = 200
+# Limite da contagem de resultados exibida na busca
+SEARCH_MAX_COUNT = 1000
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def build_fts_query(user_id, query):
+    # Cada termo vira uma frase entre aspas para que caracteres como "-", ":" ou "*"
+    # digitados pelo usuário não sejam interpretados como sintaxe do FTS5.
+    terms = [term.replace('"', '""') for term in query.split()]
+    terms_query = " ".join(f'"{term}"' for term in terms if term)
+    if not terms_query:
+        return ""
+    return f'user_id:"{int(user_id)}" AND content:({terms_query})'
+
+def normalize_search_text(text):
+    # Aproxima o tokenizer unicode61 com remove_diacritics usado no índice
+    text = text.lower()
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    return text
+
+def rank_search_candidates(query, candidates):
+    """
+    Ordena as mensagens candidatas pela parte de frequência do BM25. O IDF é
+    omitido: calculá-lo, como faz o bm25() do FTS5, exige percorrer as ocorrências
+    de cada termo de todos os usuários, o que domina o tempo de busca.
+    """
+    terms = set(SEARCH_TOKEN_RE.findall(normalize_search_text(query)))
+    if not candidates or not terms:
+        return [message_id for message_id, _ in candidates]
+    terms_re = re.compile(r"(?<![a-z0-9])(?:" + "|".join(sorted(terms)) + r")(?![a-z0-9])")
+    stats = []
+    for message_id, content in candidates:
+        text = normalize_search_text(content)
+        stats.append((message_id, len(text.split()) or 1, terms_re.findall(text)))
+    avg_length = sum(length for _, length, _ in stats) / len(stats)
+    scored = []
+    for message_id, length, matches in stats:
+        norm = SEARCH_BM25_K1 * (1 - SEARCH_BM25_B + SEARCH_BM25_B * length / avg_length)
+        score = 0.0
+        for term in terms:
+            tf = matches.count(term)
+            score += tf * (SEARCH_BM25_K1 + 1) / (tf + norm)
+        scored.append((-score, -message_id))
+    scored.sort()
+    return [-message_id for _, message_id in scored]
+
+def search_conversations(user_id, query, page=1, page_size=10):
+    """
+    Busca textual no histórico de conversas do usuário usando o índice FTS5.
+    Retorna (resultados, total) paginados; cada resultado traz o chat, a data e um
+    trecho destacado. As mensagens que casam são divididas, da mais recente para a
+    mais antiga, em janelas de SEARCH_WINDOW; dentro de cada janela a ordem segue a
+    frequência dos termos (BM25 sem IDF, ver rank_search_candidates). Assim as
+    primeiras páginas trazem as mensagens recentes mais relevantes e as seguintes
+    avançam para as mais antigas. O total é limitado a SEARCH_MAX_COUNT.
+    """
+    fts_query = build_fts_query(user_id, query)
+    if not fts_query:
+        return [], 0
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT COUNT(*) FROM (SELECT 1 FROM conversations_fts WHERE conversations_fts MATCH ? LIMIT ?)",
+        (fts_query, SEARCH_MAX_COUNT)
+    )
+    total = cursor.fetchone()[0]
+    offset = (max(page, 1) - 1) * page_size
+    window_start = offset // SEARCH_WINDOW * SEARCH_WINDOW
+    # O filtro por user_id acontece no próprio índice e a ordem por rowid é nativa do
+    # FTS5, então pular as janelas anteriores só percorre rowids, sem ler mensagens
+    cursor.execute(
+        """
+        SELECT c.id, c.content
+        FROM conversations c
+        WHERE c.id IN (
+            SELECT rowid FROM conversations_fts
+            WHERE conversations_fts MATCH ?
+            ORDER BY rowid DESC
+            LIMIT ? OFFSET ?
+        )
+        """,
+        (fts_query, SEARCH_WINDOW, window_start)
+    )
+    ranked_ids = rank_search_candidates(query, cursor.fetchall())
+    page_ids = ranked_ids[offset - window_start:offset - window_start + page_size]
+    if not page_ids:
+        return [], total
+    placeholders = ", ".join("?" for _ in page_ids)
+    cursor.execute(
+        f"""
+        SELECT c.id, c.chat_id, s.title, c.role, c.timestamp,
+               snippet(conversations_fts, 0, '**', '**', '...', 24)
+        FROM conversations_fts
+        JOIN conversations c ON c.id = conversations_fts.rowid
+        LEFT JOIN chat_sessions s ON s.id = c.chat_id
+        WHERE conversations_fts MATCH ? AND conversations_fts.rowid IN ({placeholders})
+        """,
+        (fts_query, *page_ids)
+    )
+    rows = {row[0]: row for row in cursor.fetchall()}
+    results = []
+    for message_id, chat_id, title, role, timestamp, snippet in (rows[i] for i in page_ids if i in rows):
+        results.append({
+            "id": message_id,
+            "chat_id": chat_id,
+            "chat_title": title,
+            "role": role,
+            "timestamp": timestamp,
+            "snippet": snippet,
+        })
+    return results, total
+
 # --- Conversão de mensagens para formato Gemini ---
 def messages_to_gemini(messages):
     gemini_messages = []
@@ -174,8 +363,152 @@ def messages_to_gemini(messages):
         prev_role = message["role"]
     return gemini_messages
 
+# --- Janela de contexto com resumo para chats longos ---
+# Orçamento aproximado de tokens enviados ao Gemini a cada turno. As mensagens mais
+# recentes são mantidas na íntegra; as antigas são substituídas por um resumo salvo
+# em chat_sessions e atualizado de forma incremental.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+CONTEXT_KEEP_IMAGES = int(os.getenv("CONTEXT_KEEP_IMAGES", "1"))
+IMAGE_TOKEN_ESTIMATE = 258
+SUMMARY_MODEL = "gemini-2.0-flash"
+# Espera (em segundos) antes de tentar resumir de novo após uma falha; dobra a cada
+# falha seguida até o máximo
+SUMMARY_RETRY_DELAY = 30
+SUMMARY_RETRY_MAX_DELAY = 600
+
+def estimate_message_tokens(message):
+    tokens = 0
+    for content in message["content"]:
+        if content["type"] == "text":
+            tokens += len(content["text"]) // 4 + 1
+        elif content["type"] == "image_url":
+            tokens += IMAGE_TOKEN_ESTIMATE
+    return tokens
+
+def find_context_cutoff(messages, budget):
+    # Menor índice a partir do qual as mensagens cabem no orçamento,
+    # alinhado ao início de um turno do usuário.
+    used = 0
+    cutoff = len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_message_tokens(messages[i])
+        if used > budget:
+            break
+        cutoff = i
+    while cutoff < len(messages) and messages[cutoff]["role"] != "user":
+        cutoff += 1
+    if cutoff == len(messages):
+        # A última pergunta do usuário sempre segue na íntegra
+        user_indexes = [i for i, message in enumerate(messages) if message["role"] == "user"]
+        if user_indexes:
+            cutoff = user_indexes[-1]
+    return cutoff
+
+def drop_old_images(messages, keep_images=CONTEXT_KEEP_IMAGES):
+    # Mantém apenas as imagens mais recentes; as anteriores já foram analisadas
+    # e a resposta do assistente permanece no histórico como texto.
+    trimmed = []
+    images_seen = 0
+    for message in reversed(messages):
+        contents = []
+        for content in message["content"]:
+            if content["type"] == "image_url":
+                images_seen += 1
+                if images_seen > keep_images:
+                    contents.append({"type": "text", "text": "[Imagem enviada anteriormente]"})
+                    continue
+            contents.append(content)
+        trimmed.append({"role": message["role"], "content": contents})
+    trimmed.reverse()
+    return trimmed
+
+def messages_to_text(messages):
+    lines = []
+    for message in messages:
+        role = "Assistente" if message["role"] == "assistant" else "Usuário"
+        for content in message["content"]:
+            if content["type"] == "text":
+                lines.append(f"{role}: {content['text']}")
+            elif content["type"] == "image_url":
+                lines.append(f"{role}: [Imagem]")
+    return "\n".join(lines)
+
+def summarize_messages(previous_summary, messages):
+    prompt = (
+        "Você mantém o resumo de uma conversa entre um usuário e um assistente nutricionista. "
+        "Atualize o resumo abaixo incorporando as novas mensagens. Preserve dados de saúde, "
+        "restrições, preferências, refeições analisadas com suas calorias estimadas e "
+        "recomendações feitas. Responda apenas com o resumo atualizado, de forma concisa.\n\n"
+        f"Resumo atual:\n{previous_summary or 'Nenhum'}\n\n"
+        f"Novas mensagens:\n{messages_to_text(messages)}"
+    )
+    import google.generativeai as genai
+    model = genai.GenerativeModel(
+        model_name=SUMMARY_MODEL,
+        generation_config={"temperature": 0.1}
+    )
+    return model.generate_content(prompt).text
+
+def load_chat_summary(messages, chat_id):
+    summary, summary_upto = get_chat_summary(chat_id)
+    if summary_upto > len(messages):
+        # Histórico em memória foi reiniciado; o resumo salvo não se aplica mais
+        return "", 0
+    return summary, summary_upto
+
+def build_context_messages(messages, chat_id, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Monta as mensagens enviadas ao modelo respeitando o orçamento de tokens:
+    resumo persistido das mensagens antigas seguido dos turnos recentes na íntegra.
+    Não chama o modelo; o resumo é atualizado depois da resposta por update_chat_summary.
+    Se o resumo estiver atrasado, os turnos que não cabem no orçamento são descartados.
+    """
+    messages = drop_old_images(messages)
+    summary, summary_upto = load_chat_summary(messages, chat_id)
+    if not summary:
+        return messages[find_context_cutoff(messages, budget):]
+    summary_message = {
+        "role": "user",
+        "content": [{"type": "text", "text": f"Resumo da conversa até aqui: {summary}"}]
+    }
+    remaining = max(budget - estimate_message_tokens(summary_message), 0)
+    start = max(summary_upto, find_context_cutoff(messages, remaining))
+    return [summary_message] + messages[start:]
+
+def update_chat_summary(messages, chat_id, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Incorpora ao resumo do chat os turnos que já não cabem no orçamento. Chamada
+    depois que a resposta foi transmitida, para não atrasar o turno do usuário.
+    Espera genai já configurado com a chave do usuário.
+    """
+    backoff = st.session_state.get("summary_backoff")
+    if backoff and backoff["chat_id"] == chat_id and time.time() < backoff["retry_at"]:
+        return
+    messages = drop_old_images(messages)
+    summary, summary_upto = load_chat_summary(messages, chat_id)
+    cutoff = find_context_cutoff(messages, budget)
+    if cutoff <= summary_upto:
+        return
+    # Avança até metade do orçamento para que o resumo não seja refeito a cada turno
+    new_upto = max(cutoff, find_context_cutoff(messages, budget // 2))
+    try:
+        new_summary = summarize_messages(summary, messages[summary_upto:new_upto])
+    except Exception:
+        # O resumo é só uma otimização: se a chamada falhar (resposta bloqueada,
+        # erro transitório da API), o contexto segue truncado ao orçamento e uma
+        # nova tentativa só é feita após o intervalo de espera
+        new_summary = None
+    if not new_summary:
+        failures = backoff["failures"] + 1 if backoff and backoff["chat_id"] == chat_id else 1
+        delay = min(SUMMARY_RETRY_DELAY * 2 ** (failures - 1), SUMMARY_RETRY_MAX_DELAY)
+        st.session_state.summary_backoff = {"chat_id": chat_id, "failures": failures, "retry_at": time.time() + delay}
+        return
+    st.session_state.summary_backoff = None
+    save_chat_summary(chat_id, new_summary, new_upto)
+
 # --- Função para transmitir a resposta do modelo (texto) ---
 def stream_llm_response(model_params, api_key=None, prompt_override=None):
+    import google.generativeai as genai
     response_message = ""
     genai.configure(api_key=api_key)
     model = genai.GenerativeModel(
@@ -185,13 +518,14 @@ def stream_llm_response(model_params, api_key=None, prompt_override=None):
     if prompt_override:
         gemini_messages = [{"role": "user", "parts": [prompt_override]}]
     else:
-        gemini_messages = messages_to_gemini(st.session_state.messages)
+        gemini_messages = messages_to_gemini(build_context_messages(st.session_state.messages, st.session_state.chat_id))
     for chunk in model.generate_content(contents=gemini_messages, stream=True):
         chunk_text = chunk.text or ""
         response_message += chunk_text
         yield chunk_text
     st.session_state.messages.append({"role": "assistant", "content": [{"type": "text", "text": response_message}]})
     add_message(st.session_state.chat_id, st.session_state.user["id"], "assistant", response_message)
+    update_chat_summary(st.session_state.messages, st.session_state.chat_id)
 
 # --- Nova Função: Streaming Multimídia Realtime ---
 def stream_multimedia_realtime_response(api_key, prompt_override=None):
@@ -201,6 +535,7 @@ def stream_multimedia_realtime_response(api_key, prompt_override=None):
     Cada chunk é verificado: se contiver texto, ele é enviado normalmente; se contiver dados inline,
     o MIME type é verificado e uma mensagem resumida é gerada.
     """
+    import google.generativeai as genai
     response_message = ""
     genai.configure(api_key=api_key)
     model = genai.GenerativeModel(
@@ -210,7 +545,7 @@ def stream_multimedia_realtime_response(api_key, prompt_override=None):
     if prompt_override:
         gemini_messages = [{"role": "user", "parts": [prompt_override]}]
     else:
-        gemini_messages = messages_to_gemini(st.session_state.messages)
+        gemini_messages = messages_to_gemini(build_context_messages(st.session_state.messages, st.session_state.chat_id))
     for chunk in model.generate_content(contents=gemini_messages, stream=True):
         if chunk.text:
             response_message += chunk.text
@@ -230,6 +565,7 @@ def stream_multimedia_realtime_response(api_key, prompt_override=None):
             yield msg
     st.session_state.messages.append({"role": "assistant", "content": [{"type": "text", "text": response_message}]})
     add_message(st.session_state.chat_id, st.session_state.user["id"], "assistant", response_message)
+    update_chat_summary(st.session_state.messages, st.session_state.chat_id)
 
 # --- Função para carregar a interface HTML do chat realtime via iframe ---
 def realtime_chat_interface():
@@ -237,6 +573,7 @@ def realtime_chat_interface():
     Exibe o frontend do gemini-multimodal-playground via iframe,
     com opção de alternar para o modo tela cheia.
     """
+    import streamlit.components.v1 as components
     chat_url = "http://127.0.0.1:3000/"
     st.info("Certifique-se de que o servidor do frontend esteja rodando em http://127.0.0.1:3000/")
 
@@ -282,13 +619,80 @@ def realtime_chat_interface():
 
 
 
+# --- Perfil nutricional do usuário ---
+# Fatores de atividade aplicados à taxa metabólica basal para estimar o gasto diário
+ACTIVITY_FACTORS = {
+    "Sedentário": 1.2,
+    "Moderado": 1.55,
+    "Ativo": 1.725,
+    "Muito Ativo": 1.9,
+}
+
+def build_nutrition_profile(user):
+    """
+    Calcula uma única vez as métricas derivadas dos dados de saúde (IMC, TMB, gasto
+    diário estimado e restrições normalizadas) e os trechos de prompt usados por
+    todas as análises, para que os prompts sejam idênticos entre os turnos.
+    """
+    idade = user.get("idade")
+    peso = user.get("peso")
+    altura = user.get("altura")
+    nivel_atividade = user.get("nivel_atividade")
+    restricoes_str = user.get("restricoes_alimentares") or ""
+    restricoes = [r.strip() for r in restricoes_str.split(",") if r.strip()]
+
+    imc = round(peso / (altura ** 2), 2) if peso and altura else None
+    # Mifflin-St Jeor; sem o sexo cadastrado usa-se a média das constantes (+5 e -161)
+    tmb = round(10 * peso + 6.25 * altura * 100 - 5 * idade - 78) if peso and altura and idade else None
+    gasto_diario = round(tmb * ACTIVITY_FACTORS[nivel_atividade]) if tmb and nivel_atividade in ACTIVITY_FACTORS else None
+
+    restricoes_text = ", ".join(restricoes) if restricoes else "Nenhuma"
+    health_text = f"idade {idade}, peso {peso} kg, altura {altura} m, nível de atividade física {nivel_atividade}"
+    metrics = []
+    if imc is not None:
+        metrics.append(f"IMC {imc}")
+    if tmb is not None:
+        metrics.append(f"taxa metabólica basal estimada {tmb} kcal/dia")
+    if gasto_diario is not None:
+        metrics.append(f"gasto energético diário estimado {gasto_diario} kcal/dia")
+    prompt_context = (
+        f"Perfil do usuário: {health_text}"
+        + (f"; {', '.join(metrics)}" if metrics else "")
+        + f". Restrições alimentares: {restricoes_text}."
+    )
+    return {
+        "idade": idade,
+        "peso": peso,
+        "altura": altura,
+        "nivel_atividade": nivel_atividade,
+        "restricoes": restricoes,
+        "imc": imc,
+        "tmb": tmb,
+        "gasto_diario": gasto_diario,
+        "restricoes_text": restricoes_text,
+        "health_text": health_text,
+        "prompt_context": prompt_context,
+    }
+
+def get_nutrition_profile():
+    if "nutrition_profile" not in st.session_state:
+        st.session_state.nutrition_profile = build_nutrition_profile(st.session_state.user)
+    return st.session_state.nutrition_profile
+
+def refresh_nutrition_profile():
+    st.session_state.nutrition_profile = build_nutrition_profile(st.session_state.user)
+    return st.session_state.nutrition_profile
+
 # --- Funções específicas do aplicativo ---
-def analyze_dish_image(image, google_api_key, idade, peso, altura, imc, nivel_atividade):
-    text_prompt = (
-        f"Atue como um nutricionista. Aqui estão algumas informações para ajudar a estimar as calorias do prato: "
-        f"idade {idade}, peso {peso} kg, altura {altura} m, IMC {imc} e nível de atividade física {nivel_atividade}. "
-        "Por favor, forneça uma estimativa calórica para este prato com base nas informações fornecidas."
+def build_dish_prompt(profile):
+    return (
+        f"{profile['prompt_context']}\n\n"
+        "Atue como um nutricionista. Por favor, forneça uma estimativa calórica para este prato "
+        "com base no perfil acima."
     )
+
+def analyze_dish_image(image, google_api_key):
+    text_prompt = build_dish_prompt(get_nutrition_profile())
     image_b64 = get_image_base64(image)
     # Adiciona a imagem ao histórico
     st.session_state.messages.append({
@@ -306,7 +710,7 @@ def analyze_dish_image(image, google_api_key, idade, peso, altura, imc, nivel_at
         st.write_stream(stream_llm_response({"model": "gemini-2.0-flash", "temperature": 0.3}, google_api_key))
 
 def recommend_recipes_with_ingredients(image, google_api_key):
-    restricoes = ", ".join(st.session_state.restricoes_alimentares) if st.session_state.restricoes_alimentares else ""
+    profile = get_nutrition_profile()
     image_b64 = get_image_base64(image)
     st.session_state.messages.append({
         "role": "user",
@@ -315,19 +719,18 @@ def recommend_recipes_with_ingredients(image, google_api_key):
     add_message(st.session_state.chat_id, st.session_state.user["id"], "user", "[Imagem em base64]")
     st.session_state.messages.append({
         "role": "user",
-        "content": [{"type": "text", "text": f"Baseando-se nos ingredientes da imagem e nas seguintes restrições alimentares: {restricoes}, recomende receitas saudáveis para o perfil do usuário."}]
+        "content": [{"type": "text", "text": f"{profile['prompt_context']}\n\nBaseando-se nos ingredientes da imagem e nas restrições alimentares acima, recomende receitas saudáveis para o perfil do usuário."}]
     })
-    add_message(st.session_state.chat_id, st.session_state.user["id"], "user", f"Baseando-se nos ingredientes da imagem e restrições: {restricoes}")
+    add_message(st.session_state.chat_id, st.session_state.user["id"], "user", f"Baseando-se nos ingredientes da imagem e restrições: {profile['restricoes_text']}")
     with st.chat_message("assistant"):
         st.write_stream(stream_llm_response({"model": "gemini-2.0-flash", "temperature": 0.3}, google_api_key))
 
 def generate_shopping_list_recipes(shopping_list, days, google_api_key):
-    user_health = f"idade {st.session_state.user.get('idade')}, peso {st.session_state.user.get('peso')} kg, altura {st.session_state.user.get('altura')} m, nível de atividade física {st.session_state.user.get('nivel_atividade')}"
-    restricoes = st.session_state.user.get('restricoes_alimentares') or "Nenhuma"
-    restricoes = restricoes.replace(",", ", ")
-    prompt = (f"Você é um nutricionista. Tenho a seguinte lista de compras: {shopping_list}. "
-              f"Preciso de receitas para os próximos {days} dias. Considere meus dados de saúde: {user_health} "
-              f"e minhas restrições alimentares: {restricoes}. "
+    profile = get_nutrition_profile()
+    prompt = (f"{profile['prompt_context']}\n\n"
+              f"Você é um nutricionista. Considere o perfil e as restrições alimentares acima. "
+              f"Tenho a seguinte lista de compras: {shopping_list}. "
+              f"Preciso de receitas para os próximos {days} dias. "
               f"Por favor, elabore uma receita balanceada para cada dia, contando somente com a minha lista de compras.")
     
     st.session_state.messages.append({
@@ -366,6 +769,7 @@ def login_screen():
             user = login_user(username, password)
             if user:
                 st.session_state.user = user
+                refresh_nutrition_profile()
                 chat_id = create_chat_session(user["id"])
                 st.session_state.chat_id = chat_id
                 st.session_state.messages = get_conversation_history(chat_id)
@@ -382,21 +786,18 @@ def main():
         st.write("Por favor, realize o login ou cadastro para utilizar o aplicativo.")
         return
 
-    # Inicializa restricoes_alimentares no session_state, se não existir
-    if "restricoes_alimentares" not in st.session_state:
-        restricoes = st.session_state.user.get("restricoes_alimentares", "")
-        st.session_state.restricoes_alimentares = [r.strip() for r in restricoes.split(",")] if restricoes else []
+    profile = get_nutrition_profile()
     
     st.title("App Nutrição 💬")
     
-    menu_option = st.sidebar.radio("Opções", ["Chat", "Histórico de Conversas", "Novo Chat"])
+    menu_option = st.sidebar.radio("Opções", ["Chat", "Histórico de Conversas", "Buscar Conversas", "Novo Chat"])
     
     with st.sidebar.expander("Alterar Dados de Saúde", expanded=False):
         current_idade = st.session_state.user.get("idade") or 25
         current_peso = st.session_state.user.get("peso") or 70.0
         current_altura = st.session_state.user.get("altura") or 1.75
         current_nivel = st.session_state.user.get("nivel_atividade") or "Moderado"
-        current_restricoes = st.session_state.restricoes_alimentares
+        current_restricoes = profile["restricoes"]
         new_idade = st.number_input("Idade", min_value=1, max_value=120, step=1, value=current_idade, key="upd_idade")
         new_peso = st.number_input("Peso (kg)", min_value=1.0, format="%.2f", value=current_peso, key="upd_peso")
         new_altura = st.number_input("Altura (m)", min_value=0.5, format="%.2f", value=current_altura, key="upd_altura")
@@ -412,7 +813,7 @@ def main():
             st.session_state.user["altura"] = new_altura
             st.session_state.user["nivel_atividade"] = new_nivel
             st.session_state.user["restricoes_alimentares"] = ",".join(new_restricoes)
-            st.session_state.restricoes_alimentares = new_restricoes
+            profile = refresh_nutrition_profile()
             st.success("Dados de saúde atualizados com sucesso!")
     
     google_api_key = st.text_input("Sua chave API do Google", value=st.session_state.user.get("api_key") or "", type="password")
@@ -424,8 +825,11 @@ def main():
     st.sidebar.write(f"**Peso (kg):** {st.session_state.user.get('peso', 'N/D')}")
     st.sidebar.write(f"**Altura (m):** {st.session_state.user.get('altura', 'N/D')}")
     st.sidebar.write(f"**Nível de Atividade:** {st.session_state.user.get('nivel_atividade', 'N/D')}")
-    restricoes_disp = st.session_state.restricoes_alimentares
-    st.sidebar.write(f"**Restrições Alimentares:** {', '.join(restricoes_disp) if restricoes_disp else 'Nenhuma'}")
+    st.sidebar.write(f"**Restrições Alimentares:** {profile['restricoes_text']}")
+    if profile["imc"] is not None:
+        st.sidebar.write(f"**IMC:** {profile['imc']}")
+    if profile["gasto_diario"] is not None:
+        st.sidebar.write(f"**Gasto Diário Estimado:** {profile['gasto_diario']} kcal")
     
     st.sidebar.divider()
     st.sidebar.write("### **Opções de Análise**")
@@ -443,9 +847,11 @@ def main():
 
     if st.sidebar.button("🗑️ Resetar conversa"):
         st.session_state.messages = []
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM conversations WHERE chat_id = ?", (st.session_state.chat_id,))
         conn.commit()
+        save_chat_summary(st.session_state.chat_id, None, 0)
 
     if menu_option == "Histórico de Conversas":
         st.subheader("Histórico de Conversas")
@@ -460,6 +866,28 @@ def main():
         else:
             st.write("Nenhuma conversa encontrada.")
         return
+    elif menu_option == "Buscar Conversas":
+        st.subheader("Buscar Conversas")
+        search_query = st.text_input("Pesquisar no histórico", key="search_query")
+        if st.session_state.get("search_last_query") != search_query:
+            # Nova busca volta para a primeira página
+            st.session_state.search_last_query = search_query
+            st.session_state.search_page = 1
+        if search_query:
+            page_size = 10
+            page = st.number_input("Página", min_value=1, step=1, key="search_page")
+            results, total = search_conversations(st.session_state.user["id"], search_query, page, page_size)
+            if results:
+                total_pages = (total + page_size - 1) // page_size
+                more = "+" if total >= SEARCH_MAX_COUNT else ""
+                st.caption(f"{total}{more} resultado(s) - página {page} de {total_pages}{more}")
+                for result in results:
+                    st.write(f"**Chat ID {result['chat_id']} - {result['chat_title']}** ({result['timestamp']}) - {result['role'].capitalize()}")
+                    st.write(result["snippet"])
+                    st.write("---")
+            else:
+                st.write("Nenhuma mensagem encontrada.")
+        return
     elif menu_option == "Novo Chat":
         new_chat_id = create_chat_session(st.session_state.user["id"])
         st.session_state.chat_id = new_chat_id
@@ -476,10 +904,10 @@ def main():
     else:
         st.subheader("Conversa")
         if uploaded_image:
+            from PIL import Image
             image = Image.open(uploaded_image)
             if option == "Calcular Calorias do Prato":
-                imc = round(st.session_state.user.get("peso", 70) / (st.session_state.user.get("altura", 1.75) ** 2), 2) if st.session_state.user.get("altura") else 0
-                analyze_dish_image(image, google_api_key, st.session_state.user.get("idade"), st.session_state.user.get("peso"), st.session_state.user.get("altura"), imc, st.session_state.user.get("nivel_atividade"))
+                analyze_dish_image(image, google_api_key)
             elif option == "Recomendar Receitas com Ingredientes":
                 recommend_recipes_with_ingredients(image, google_api_key)
 
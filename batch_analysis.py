@@ -0,0 +1,213 @@
+"""
+Análise em lote de fotos de refeições (modo offline).
+
+Recebe uma lista de arquivos e/ou pastas com fotos, pré-processa as imagens em
+paralelo, envia as estimativas calóricas ao Gemini com concorrência limitada e
+retry com backoff, e grava todos os resultados em um novo chat do usuário
+(tabelas chat_sessions/conversations) em uma única transação.
+
+Uso:
+    python batch_analysis.py --username maria fotos/semana1 extra.jpg
+    python batch_analysis.py --username maria fotos/ --concurrency 4 --retries 5
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import dotenv
+
+from app_nutricional import build_dish_prompt, build_nutrition_profile, init_db
+
+dotenv.load_dotenv()
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# Maior lado da imagem enviada ao modelo; fotos de celular são reduzidas antes do envio
+MAX_IMAGE_SIDE = 1024
+DEFAULT_MODEL = "gemini-2.0-flash"
+
+
+def collect_image_paths(paths):
+    image_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    image_paths.append(os.path.join(path, name))
+        elif path.lower().endswith(IMAGE_EXTENSIONS):
+            image_paths.append(path)
+        else:
+            print(f"Ignorando {path}: não é uma imagem suportada.", file=sys.stderr)
+    return image_paths
+
+
+def preprocess_image(path):
+    from PIL import Image, ImageOps
+    with Image.open(path) as image:
+        # Fotos de celular costumam vir giradas com a orientação só no EXIF, que se
+        # perde ao salvar de novo; aplica a rotação antes de redimensionar
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        buffered = BytesIO()
+        image.save(buffered, format="JPEG", quality=85)
+    return {"mime_type": "image/jpeg", "data": buffered.getvalue()}
+
+
+def get_user(conn, username):
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, api_key, idade, peso, altura, nivel_atividade, restricoes_alimentares FROM users WHERE username = ?",
+        (username,)
+    )
+    result = cursor.fetchone()
+    if not result:
+        return None
+    return {
+        "id": result[0],
+        "username": username,
+        "api_key": result[1],
+        "idade": result[2],
+        "peso": result[3],
+        "altura": result[4],
+        "nivel_atividade": result[5],
+        "restricoes_alimentares": result[6]
+    }
+
+
+def generate_with_retry(model, contents, retries, base_delay):
+    from google.api_core import exceptions
+    transient = (
+        exceptions.ResourceExhausted,
+        exceptions.ServiceUnavailable,
+        exceptions.InternalServerError,
+        exceptions.DeadlineExceeded,
+    )
+    for attempt in range(retries + 1):
+        try:
+            return model.generate_content(contents).text
+        except transient:
+            if attempt == retries:
+                raise
+            # Backoff exponencial com jitter para não sincronizar as requisições
+            time.sleep(base_delay * (2 ** attempt) * (1 + random.random()))
+
+
+def save_results(conn, user_id, title, prompt, results):
+    """Grava o chat e todas as mensagens do lote em uma única transação."""
+    with conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO chat_sessions (user_id, title) VALUES (?, ?)", (user_id, title))
+        chat_id = cursor.lastrowid
+        rows = []
+        for path, response in results:
+            name = os.path.basename(path)
+            rows.append((chat_id, user_id, "user", f"[Imagem em base64] {name}"))
+            rows.append((chat_id, user_id, "user", prompt))
+            rows.append((chat_id, user_id, "assistant", response))
+        cursor.executemany(
+            "INSERT INTO conversations (chat_id, user_id, role, content) VALUES (?, ?, ?, ?)",
+            rows
+        )
+    return chat_id
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimativa calórica em lote para fotos de refeições")
+    parser.add_argument("paths", nargs="+", help="arquivos de imagem ou pastas com fotos")
+    parser.add_argument("--username", required=True, help="usuário cadastrado dono das fotos")
+    parser.add_argument("--api-key", help="chave API do Google (padrão: a do cadastro ou GOOGLE_API_KEY)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="modelo Gemini utilizado")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="threads de pré-processamento")
+    parser.add_argument("--concurrency", type=int, default=4, help="chamadas simultâneas ao Gemini")
+    parser.add_argument("--retries", type=int, default=3, help="novas tentativas por imagem em erros transitórios")
+    parser.add_argument("--backoff", type=float, default=1.0, help="atraso inicial do backoff, em segundos")
+    parser.add_argument("--title", help="título do chat criado (padrão: Análise em lote)")
+    args = parser.parse_args()
+    if args.retries < 0:
+        parser.error("--retries deve ser maior ou igual a 0.")
+    if args.workers < 1:
+        parser.error("--workers deve ser maior ou igual a 1.")
+    if args.concurrency < 1:
+        parser.error("--concurrency deve ser maior ou igual a 1.")
+    if args.backoff < 0:
+        parser.error("--backoff deve ser maior ou igual a 0.")
+
+    conn = init_db()
+    user = get_user(conn, args.username)
+    if not user:
+        parser.error(f"Usuário {args.username} não encontrado.")
+    api_key = args.api_key or user["api_key"] or os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        parser.error("Informe --api-key, cadastre a chave do usuário ou defina GOOGLE_API_KEY.")
+
+    image_paths = collect_image_paths(args.paths)
+    if not image_paths:
+        parser.error("Nenhuma imagem encontrada.")
+
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel(
+        model_name=args.model,
+        generation_config={"temperature": 0.3}
+    )
+    prompt = build_dish_prompt(build_nutrition_profile(user))
+
+    def preprocess(path):
+        try:
+            return path, preprocess_image(path), None
+        except Exception as e:
+            return path, None, e
+
+    images = []
+    failures = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for path, image, error in executor.map(preprocess, image_paths):
+            if error is None:
+                images.append((path, image))
+            else:
+                # Arquivo corrompido ou ilegível não interrompe o lote
+                failures.append(path)
+                print(f"ERRO {path}: {error}", file=sys.stderr)
+    preprocess_time = time.perf_counter() - start
+
+    def analyze(item):
+        path, image = item
+        try:
+            return path, generate_with_retry(model, [prompt, image], args.retries, args.backoff), None
+        except Exception as e:
+            return path, None, e
+
+    results = []
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for path, response, error in executor.map(analyze, images):
+            if error is None:
+                results.append((path, response))
+                print(f"OK   {path}")
+            else:
+                failures.append(path)
+                print(f"ERRO {path}: {error}", file=sys.stderr)
+    analysis_time = time.perf_counter() - start - preprocess_time
+
+    chat_id = None
+    if results:
+        title = args.title or f"Análise em lote ({len(results)} fotos)"
+        chat_id = save_results(conn, user["id"], title, prompt, results)
+    total_time = time.perf_counter() - start
+
+    print(f"\n{len(results)} de {len(image_paths)} imagens analisadas em {total_time:.1f} s "
+          f"({len(results) / total_time:.2f} imagens/s)")
+    print(f"  pré-processamento: {preprocess_time:.1f} s | análise: {analysis_time:.1f} s")
+    if chat_id is not None:
+        print(f"  resultados salvos no Chat ID {chat_id}")
+    if failures:
+        print(f"  {len(failures)} falha(s): {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
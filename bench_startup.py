@@ -0,0 +1,62 @@
+"""
+Benchmark de inicialização do app_nutricional.py.
+
+Mede, em processos Python novos, o tempo de import do módulo (cold start de cada
+worker/réplica) e lista os imports mais caros segundo `python -X importtime`.
+
+Uso:
+    python bench_startup.py [--runs 10] [--top 15]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+IMPORT_STMT = "import app_nutricional"
+
+
+def time_import(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", IMPORT_STMT], cwd=APP_DIR, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def profile_imports(top):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT_STMT],
+        cwd=APP_DIR, check=True, capture_output=True, text=True
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        # Formato: "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace("import time:", "|", 1).split("|")]
+        entries.append((int(cumulative_us), int(self_us), name.strip()))
+    entries.sort(reverse=True)
+    return entries[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o tempo de import do app_nutricional.py")
+    parser.add_argument("--runs", type=int, default=10, help="número de processos medidos")
+    parser.add_argument("--top", type=int, default=15, help="quantidade de imports listados no perfil")
+    args = parser.parse_args()
+
+    timings = time_import(args.runs)
+    print(f"Import de app_nutricional ({args.runs} execuções, processo novo):")
+    print(f"  mediana {statistics.median(timings):.1f} ms | mín {min(timings):.1f} ms | máx {max(timings):.1f} ms")
+
+    print(f"\nImports mais caros (cumulativo, top {args.top}):")
+    for cumulative_us, self_us, name in profile_imports(args.top):
+        print(f"  {cumulative_us / 1000:8.1f} ms  (próprio {self_us / 1000:6.1f} ms)  {name}")
+
+
+if __name__ == "__main__":
+    main()